@@ -0,0 +1,172 @@
+"""Адаптивное расписание напоминаний.
+
+Только стандартная библиотека: модуль используется ботом (nachbot.py) и
+запускается отдельно для офлайн-симуляции по журналу напоминаний:
+
+    python adaptive.py tasks.db
+"""
+import math
+import random
+import sqlite3
+import sys
+from collections import defaultdict
+
+START_HOUR = 7
+END_HOUR = 21
+# Пока по пользователю мало данных — используем обычное равномерное расписание
+ADAPTIVE_MIN_SENT = 20
+ADAPTIVE_MIN_RESPONSES = 5
+# Адаптивное расписание не короче этой доли от обычного количества напоминаний
+ADAPTIVE_MIN_SHARE = 0.75
+# Час оставляем, если его доля ответов не ниже этой части от лучшего часа
+ADAPTIVE_KEEP_RATIO = 0.5
+# Вес общего процента ответов пользователя для часов с малым числом данных
+PRIOR_WEIGHT = 2
+
+
+def uniform_slots(reminders_per_day, start_hour=START_HOUR, end_hour=END_HOUR):
+    """Равномерные слоты (час, минута) с небольшим случайным сдвигом."""
+    interval = (end_hour - start_hour) * 60 // reminders_per_day
+    times = []
+    for i in range(reminders_per_day):
+        base_minute = start_hour * 60 + i * interval
+        # Добавляем случайный сдвиг в пределах 15 минут
+        minute = base_minute + random.randint(-10, 10)
+        hour = minute // 60
+        min_in_hour = minute % 60
+        # Не выходим за границы 7:00-21:00
+        hour = max(start_hour, min(hour, end_hour - 1))
+        min_in_hour = max(0, min(min_in_hour, 59))
+        times.append((hour, min_in_hour))
+    return times
+
+
+def hour_rates(hour_stats, start_hour=START_HOUR, end_hour=END_HOUR):
+    """Сглаженная доля ответов по часам.
+
+    hour_stats: {час: (отправлено, с ответом)}. Часы без данных получают
+    общий процент ответов пользователя.
+    """
+    sent_total = sum(sent for sent, _ in hour_stats.values())
+    responded_total = sum(responded for _, responded in hour_stats.values())
+    prior = responded_total / sent_total if sent_total else 0.0
+    rates = {}
+    for hour in range(start_hour, end_hour):
+        sent, responded = hour_stats.get(hour, (0, 0))
+        rates[hour] = (responded + PRIOR_WEIGHT * prior) / (sent + PRIOR_WEIGHT)
+    return rates
+
+
+def adaptive_hours(hour_stats, reminders_per_day, start_hour=START_HOUR, end_hour=END_HOUR):
+    """Часы для напоминаний или None, если данных для адаптации недостаточно.
+
+    Берутся только часы, в которые напоминания уже отправлялись: сначала те,
+    где доля ответов близка к лучшей, затем остальные по убыванию доли.
+    Непроверенные часы не используются — если проверенных не хватает на все
+    слоты, остаётся обычное расписание.
+    """
+    observed = {hour: stats for hour, stats in hour_stats.items()
+                if start_hour <= hour < end_hour and stats[0] > 0}
+    if (sum(sent for sent, _ in observed.values()) < ADAPTIVE_MIN_SENT
+            or sum(responded for _, responded in observed.values()) < ADAPTIVE_MIN_RESPONSES):
+        return None
+    rates = hour_rates(observed, start_hour, end_hour)
+    ranked = sorted(observed, key=lambda hour: rates[hour], reverse=True)
+    best = rates[ranked[0]]
+    kept = [hour for hour in ranked if rates[hour] >= best * ADAPTIVE_KEEP_RATIO]
+    count = max(math.ceil(reminders_per_day * ADAPTIVE_MIN_SHARE), min(len(kept), reminders_per_day))
+    if len(ranked) < count:
+        return None
+    return sorted(ranked[:count])
+
+
+def plan_reminder_slots(reminders_per_day, hour_stats=None, start_hour=START_HOUR, end_hour=END_HOUR):
+    """Слоты (час, минута) на один день.
+
+    По истории ответов переносит напоминания в часы, когда пользователь на них
+    реагирует, и убирает часть слотов из «мёртвых» часов — но не больше
+    четверти от обычного количества для приоритета задачи. Без истории
+    возвращает обычное равномерное расписание.
+    """
+    hours = adaptive_hours(hour_stats or {}, reminders_per_day, start_hour, end_hour)
+    if hours is None:
+        return uniform_slots(reminders_per_day, start_hour, end_hour)
+    return [(hour, random.randint(0, 59)) for hour in hours]
+
+
+# --- Офлайн-симуляция по журналу напоминаний ---
+
+def build_hour_stats(events):
+    """{час: (отправлено, с ответом)} из событий журнала."""
+    stats = defaultdict(lambda: [0, 0])
+    for event in events:
+        stats[event["hour"]][0] += 1
+        if event["responded_at"]:
+            stats[event["hour"]][1] += 1
+    return {hour: tuple(counts) for hour, counts in stats.items()}
+
+
+def simulate(events, reminders_per_day=8, train_share=0.5):
+    """Прогоняет адаптивное расписание по записанному журналу.
+
+    Для каждого пользователя статистика строится по первой части журнала
+    (train_share), а на оставшейся части считается, сколько напоминаний было
+    бы отправлено и сколько ответов сохранилось бы, если слать только в
+    выбранные часы.
+    """
+    by_user = defaultdict(list)
+    for event in events:
+        by_user[event["user_id"]].append(event)
+    result = {"users": 0, "adapted_users": 0,
+              "baseline_sent": 0, "baseline_responded": 0,
+              "adaptive_sent": 0, "adaptive_responded": 0}
+    for user_events in by_user.values():
+        user_events.sort(key=lambda event: event["sent_at"])
+        split = int(len(user_events) * train_share)
+        train, test = user_events[:split], user_events[split:]
+        hours = adaptive_hours(build_hour_stats(train), reminders_per_day)
+        result["users"] += 1
+        if hours is not None:
+            result["adapted_users"] += 1
+        for event in test:
+            responded = bool(event["responded_at"])
+            result["baseline_sent"] += 1
+            result["baseline_responded"] += responded
+            if hours is None or event["hour"] in hours:
+                result["adaptive_sent"] += 1
+                result["adaptive_responded"] += responded
+    return result
+
+
+def load_events(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        '''SELECT user_id, task_id, sent_at, hour, responded_at FROM reminder_log
+           WHERE closed_by_other = 0 ORDER BY sent_at'''
+    ).fetchall()
+    conn.close()
+    return [
+        {"user_id": user_id, "task_id": task_id, "sent_at": sent_at, "hour": hour, "responded_at": responded_at}
+        for user_id, task_id, sent_at, hour, responded_at in rows
+    ]
+
+
+def print_report(result):
+    def share(part, whole):
+        return round(part / whole * 100, 1) if whole else 0
+
+    saved = result["baseline_sent"] - result["adaptive_sent"]
+    print(f"Пользователей: {result['users']} (адаптировано: {result['adapted_users']})")
+    print(f"Напоминаний: {result['baseline_sent']} -> {result['adaptive_sent']} "
+          f"(экономия {share(saved, result['baseline_sent'])}%)")
+    print(f"Ответов: {result['baseline_responded']} -> {result['adaptive_responded']} "
+          f"(сохранено {share(result['adaptive_responded'], result['baseline_responded'])}%)")
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "tasks.db"
+    try:
+        events = load_events(db_path)
+    except sqlite3.OperationalError:
+        sys.exit(f"В {db_path} нет журнала напоминаний (таблица reminder_log).")
+    print_report(simulate(events))
@@ -1,10 +1,15 @@
 import os
+import html
+import asyncio
 import sqlite3
 import logging
+import time
+from collections import deque
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.context import FSMContext
@@ -13,6 +18,7 @@ from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import random
 import pytz
+from adaptive import plan_reminder_slots
 
 # --- Логирование и переменные окружения ---
 logging.basicConfig(level=logging.INFO)
@@ -41,8 +47,45 @@ cursor.execute('''CREATE TABLE IF NOT EXISTS tasks
      checklist TEXT,
      attachments TEXT
     )''')
+# Участники командных задач (владелец задачи хранится в tasks.user_id)
+cursor.execute('''CREATE TABLE IF NOT EXISTS task_members
+    (task_id INTEGER,
+     user_id INTEGER,
+     added_at DATETIME,
+     PRIMARY KEY (task_id, user_id)
+    )''')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_members_user ON task_members (user_id)')
+# Журнал напоминаний: когда отправили и когда пользователь отреагировал (закрыл задачу)
+cursor.execute('''CREATE TABLE IF NOT EXISTS reminder_log
+    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+     user_id INTEGER,
+     task_id INTEGER,
+     sent_at DATETIME,
+     hour INTEGER,
+     responded_at DATETIME,
+     closed_by_other INTEGER DEFAULT 0
+    )''')
+# closed_by_other: командную задачу закрыл другой участник, у этого не было шанса ответить
+cursor.execute('PRAGMA table_info(reminder_log)')
+if 'closed_by_other' not in [column[1] for column in cursor.fetchall()]:
+    cursor.execute('ALTER TABLE reminder_log ADD COLUMN closed_by_other INTEGER DEFAULT 0')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminder_log_user ON reminder_log (user_id, sent_at)')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminder_log_task ON reminder_log (task_id, user_id)')
 conn.commit()
 
+# За какой период учитываем реакцию на напоминания при подборе расписания
+ENGAGEMENT_WINDOW_DAYS = 30
+# Закрытие задачи считается ответом на напоминание, только если прошло не больше этого
+RESPONSE_WINDOW_MINUTES = 120
+
+# --- Рассылка по командным задачам ---
+# Telegram ограничивает бота ~30 сообщениями в секунду. Лимит общий для всех
+# рассылок: задания разных задач, сработавшие в одну минуту, делят его между собой
+BROADCAST_RATE_LIMIT = 25
+BROADCAST_BATCH_SIZE = 20
+send_times = deque()
+send_lock = asyncio.Lock()
+
 # --- Состояния FSM ---
 class TaskStates(StatesGroup):
     waiting_for_task = State()
@@ -54,6 +97,7 @@ class TaskStates(StatesGroup):
     waiting_for_report = State()
     editing_task_text = State()
     adding_checklist = State()
+    waiting_for_share_members = State()
 
 # --- Мотивационные цитаты ---
 MOTIVATION_QUOTES = [
@@ -80,6 +124,7 @@ def main_keyboard():
         types.KeyboardButton(text="🍇 Статистика"),
         types.KeyboardButton(text="🍌 Мотивация дня")
     )
+    builder.row(types.KeyboardButton(text="👥 Поделиться задачей"))
     return builder.as_markup(resize_keyboard=True)
 
 def complete_keyboard(task_id):
@@ -240,11 +285,12 @@ def get_ai_hint(task_text: str) -> str:
 async def start(message: types.Message):
     description = (
         "<b>Я — твой начальник-бот!</b>\n\n"
-        "Я помогу тебе не забывать о задачах и буду напоминать о них в течение дня (от 5 до 10 раз, с 7:00 до 21:00 МСК).\n"
+        "Я помогу тебе не забывать о задачах и буду напоминать о них в течение дня (до 10 раз, с 7:00 до 21:00 МСК). Со временем я подстрою напоминания под часы, когда ты на них реагируешь.\n"
         "Вот что я умею:\n"
         "• <b>🍏 Новая задача</b> — добавь задачу, и я буду напоминать о ней.\n"
         "• <b>🥕 Мои задачи</b> — покажу список твоих активных задач.\n"
         "• <b>🍉 Мои успехи</b> — выгружу твои задачи и отчеты за последний месяц.\n"
+        "• <b>👥 Поделиться задачей</b> — добавь коллег, и напоминания будут приходить всей команде.\n"
         "• Когда ты отмечаешь задачу как выполненную, я предложу сразу написать отчет.\n"
         "• Я шучу, мотивирую и иногда подшучиваю над тобой!\n"
         "• Если ты не отмечаешь задачу как выполненную больше 3 дней — я начну напоминать об этом особо настойчиво!\n"
@@ -330,25 +376,16 @@ async def finish_task_creation(message: types.Message, state: FSMContext):
         id=f"remind_{task_id}_first",
         replace_existing=True
     )
-    # Остальные напоминания равномерно с 7:00 до 21:00 МСК
+    # Остальные напоминания с 7:00 до 21:00 МСК: равномерно, а если есть история
+    # ответов — только в часы, когда пользователь реагирует
+    hour_stats = load_hour_stats(message.from_user.id)
     for day in range(data['days']):
         if data.get('priority', 'обычная') == "важная":
             reminders_per_day = random.randint(8, 10)
         else:
             reminders_per_day = random.randint(7, 8)
-        start_hour = 7
-        end_hour = 21
-        interval = (end_hour - start_hour) * 60 // reminders_per_day
         times = []
-        for i in range(reminders_per_day):
-            base_minute = start_hour * 60 + i * interval
-            # Добавляем случайный сдвиг в пределах 15 минут
-            minute = base_minute + random.randint(-10, 10)
-            hour = minute // 60
-            min_in_hour = minute % 60
-            # Не выходим за границы 7:00-21:00
-            hour = max(start_hour, min(hour, end_hour - 1))
-            min_in_hour = max(0, min(min_in_hour, 59))
+        for hour, min_in_hour in plan_reminder_slots(reminders_per_day, hour_stats):
             # В первый день пропускаем напоминания, которые раньше текущего времени + 20 минут
             if day == 0:
                 dt_check = now.replace(hour=hour, minute=min_in_hour, second=0, microsecond=0)
@@ -372,6 +409,50 @@ async def finish_task_creation(message: types.Message, state: FSMContext):
                 replace_existing=False
             )
 
+def load_hour_stats(user_id: int):
+    """{час МСК: (отправлено, с ответом)} за последние ENGAGEMENT_WINDOW_DAYS дней."""
+    since = datetime.now() - timedelta(days=ENGAGEMENT_WINDOW_DAYS)
+    cursor.execute(
+        '''SELECT hour, COUNT(*), COUNT(responded_at) FROM reminder_log
+           WHERE user_id = ? AND sent_at >= ? AND closed_by_other = 0
+           GROUP BY hour''',
+        (user_id, since)
+    )
+    return {hour: (sent, responded) for hour, sent, responded in cursor.fetchall()}
+
+def log_reminders(user_ids, task_id: int):
+    now = datetime.now()
+    hour = datetime.now(pytz.timezone("Europe/Moscow")).hour
+    cursor.executemany(
+        'INSERT INTO reminder_log (user_id, task_id, sent_at, hour) VALUES (?, ?, ?, ?)',
+        [(uid, task_id, now, hour) for uid in user_ids]
+    )
+    conn.commit()
+
+def log_response(user_id: int, task_id: int):
+    """Засчитывает закрытие задачи как ответ на последнее напоминание о ней.
+
+    Ответом считается только закрытие в течение RESPONSE_WINDOW_MINUTES после
+    напоминания — иначе час ответа не имеет отношения к часу напоминания.
+    Открытые напоминания остальных участников командной задачи помечаются
+    closed_by_other и не считаются проигнорированными.
+    """
+    now = datetime.now()
+    cursor.execute(
+        '''UPDATE reminder_log SET responded_at = ?
+           WHERE id = (SELECT id FROM reminder_log
+                       WHERE task_id = ? AND user_id = ? AND responded_at IS NULL
+                       ORDER BY sent_at DESC LIMIT 1)
+             AND sent_at >= ?''',
+        (now, task_id, user_id, now - timedelta(minutes=RESPONSE_WINDOW_MINUTES))
+    )
+    cursor.execute(
+        '''UPDATE reminder_log SET closed_by_other = 1
+           WHERE task_id = ? AND user_id != ? AND responded_at IS NULL''',
+        (task_id, user_id)
+    )
+    conn.commit()
+
 async def send_first_reminder(user_id: int, task_text: str):
     await bot.send_message(
         user_id,
@@ -417,11 +498,27 @@ async def stats_btn(message: types.Message):
     done = cursor.fetchone()[0]
     cursor.execute('SELECT COUNT(*) FROM tasks WHERE user_id = ? AND status = "active"', (user_id,))
     active = cursor.fetchone()[0]
+    # Только по уже выполненным задачам: по активным ещё рано судить о реакции
+    cursor.execute(
+        '''SELECT COUNT(*), COUNT(DISTINCT r.task_id),
+                  AVG((julianday(r.responded_at) - julianday(r.sent_at)) * 24 * 60)
+           FROM reminder_log r JOIN tasks t ON t.id = r.task_id
+           WHERE r.user_id = ? AND r.sent_at >= ? AND r.closed_by_other = 0
+             AND t.status = "completed"''',
+        (user_id, datetime.now() - timedelta(days=ENGAGEMENT_WINDOW_DAYS))
+    )
+    sent, closed_tasks, avg_minutes = cursor.fetchone()
+    reaction_str = ""
+    if sent:
+        reaction_str = f"\n🔔 В среднем напоминаний до выполнения задачи: {round(sent / closed_tasks, 1)}"
+        if avg_minutes is not None:
+            reaction_str += f"\n⏱ Среднее время от последнего напоминания до выполнения: {round(avg_minutes)} мин."
     await message.answer(
         f"📊 Всего задач: {total}\n"
         f"✅ Выполнено: {done}\n"
         f"🕒 Активных: {active}\n"
-        f"Процент выполнения: {round(done / total * 100, 1) if total else 0}%",
+        f"Процент выполнения: {round(done / total * 100, 1) if total else 0}%"
+        f"{reaction_str}",
         reply_markup=stats_success_keyboard()
     )
 
@@ -466,6 +563,7 @@ async def delete_task_btn(message: types.Message, state: FSMContext):
 async def delete_task(callback: types.CallbackQuery):
     task_id = int(callback.data.split("_")[1])
     cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+    cursor.execute('DELETE FROM task_members WHERE task_id = ?', (task_id,))
     conn.commit()
     await callback.message.edit_text("Задача удалена.")
 
@@ -548,6 +646,89 @@ async def save_checklist(message: types.Message, state: FSMContext):
     await message.answer("Чек-лист обновлен.", reply_markup=main_keyboard())
     await state.clear()
 
+# --- Командные задачи ---
+@dp.message(F.text.in_(["👥 Поделиться задачей"]))
+async def share_task_btn(message: types.Message, state: FSMContext):
+    cursor.execute('SELECT id, task_text FROM tasks WHERE user_id = ? AND status = "active"', (message.from_user.id,))
+    tasks = cursor.fetchall()
+    if not tasks:
+        await message.answer("Нет задач, которыми можно поделиться.")
+        return
+    kb = InlineKeyboardBuilder()
+    for task in tasks:
+        kb.add(types.InlineKeyboardButton(
+            text=task[1][:30], callback_data=f"share_{task[0]}"
+        ))
+    await message.answer("Выбери задачу, которой хочешь поделиться с командой:", reply_markup=kb.as_markup())
+    await state.clear()
+
+@dp.callback_query(F.data.startswith("share_"))
+async def share_task(callback: types.CallbackQuery, state: FSMContext):
+    task_id = int(callback.data.split("_")[1])
+    cursor.execute('SELECT id FROM tasks WHERE id = ? AND user_id = ? AND status = "active"',
+                   (task_id, callback.from_user.id))
+    if not cursor.fetchone():
+        await callback.message.answer("Задача не найдена.")
+        await callback.answer()
+        return
+    await state.update_data(share_task_id=task_id)
+    await callback.message.answer(
+        "Пришли Telegram ID участников через запятую или пробел.\n"
+        "Каждый участник должен хотя бы раз написать боту /start, иначе я не смогу ему писать.\n\n"
+        "(или напиши 'Отмена' для выхода)"
+    )
+    await state.set_state(TaskStates.waiting_for_share_members)
+    await callback.answer()
+
+@dp.message(TaskStates.waiting_for_share_members)
+async def save_share_members(message: types.Message, state: FSMContext):
+    if message.text.lower() == "отмена":
+        await message.answer("Добавление участников отменено.", reply_markup=main_keyboard())
+        await state.clear()
+        return
+    data = await state.get_data()
+    task_id = data.get("share_task_id")
+    # Делиться можно только своей активной задачей
+    cursor.execute('SELECT task_text FROM tasks WHERE id = ? AND user_id = ? AND status = "active"',
+                   (task_id, message.from_user.id))
+    row = cursor.fetchone()
+    if not row:
+        await message.answer("Задача не найдена.", reply_markup=main_keyboard())
+        await state.clear()
+        return
+    member_ids = {int(part) for part in message.text.replace(",", " ").split() if part.isdigit()}
+    member_ids.discard(message.from_user.id)
+    if not member_ids:
+        await message.answer("Не нашел ни одного ID. Пришли числа через запятую или напиши 'Отмена'.")
+        return
+    now = datetime.now()
+    added_ids = []
+    for member_id in sorted(member_ids):
+        cursor.execute(
+            'INSERT OR IGNORE INTO task_members (task_id, user_id, added_at) VALUES (?, ?, ?)',
+            (task_id, member_id, now)
+        )
+        if cursor.rowcount:
+            added_ids.append(member_id)
+    conn.commit()
+    await state.clear()
+    if not added_ids:
+        await message.answer("Все эти участники уже есть в задаче.", reply_markup=main_keyboard())
+        return
+    delivered = await broadcast(
+        added_ids,
+        f"👥 Тебя добавили в командную задачу: <b>{html.escape(row[0])}</b>\nТеперь я буду напоминать о ней и тебе!",
+        reply_markup=complete_keyboard(task_id)
+    )
+    text = f"Участников добавлено: {len(added_ids)}."
+    if len(added_ids) < len(member_ids):
+        text += f"\nУже были в задаче: {len(member_ids) - len(added_ids)}."
+    unreachable = [member_id for member_id in added_ids if member_id not in delivered]
+    if unreachable:
+        text += (f"\nНе смог написать: {', '.join(map(str, unreachable))}. "
+                 "Пусть они отправят боту /start — тогда напоминания начнут приходить и им.")
+    await message.answer(text, reply_markup=main_keyboard())
+
 # --- Режим выходного ---
 @dp.message(F.text.in_(["🛌 Режим выходного"]))
 async def weekend_btn(message: types.Message):
@@ -559,22 +740,33 @@ async def weekend_btn(message: types.Message):
 # --- Мои задачи ---
 @dp.message(F.text.in_(["🥕 Мои задачи", "Мои задачи"]))
 async def my_tasks(message: types.Message):
-    cursor.execute('SELECT * FROM tasks WHERE user_id = ? AND status = "active"', (message.from_user.id,))
+    user_id = message.from_user.id
+    cursor.execute(
+        '''SELECT * FROM tasks
+           WHERE status = "active"
+             AND (user_id = ? OR id IN (SELECT task_id FROM task_members WHERE user_id = ?))''',
+        (user_id, user_id)
+    )
     tasks = cursor.fetchall()
     if not tasks:
         await message.answer("У тебя нет активных задач. Создай новую задачу с помощью кнопки '🍏 Новая задача'.")
         return
     text = "Вот твои активные задачи:\n"
     for idx, task in enumerate(tasks, 1):
-        text += f"{idx}. {task[2]} (Приоритет: {task[7]})\n"
+        team_mark = " 👥" if task[1] != user_id else ""
+        text += f"{idx}. {task[2]} (Приоритет: {task[7]}){team_mark}\n"
     await message.answer(text, reply_markup=tasks_list_keyboard(tasks))
 
 # --- Завершить задачу ---
 @dp.callback_query(F.data.startswith("complete_"))
 async def complete_task(callback: types.CallbackQuery, state: FSMContext):
     task_id = callback.data.split("_")[1]
+    cursor.execute('SELECT task_text, status FROM tasks WHERE id = ?', (task_id,))
+    row = cursor.fetchone()
     cursor.execute('UPDATE tasks SET status = "completed" WHERE id = ?', (task_id,))
     conn.commit()
+    if row and row[1] == "active":
+        log_response(callback.from_user.id, int(task_id))
     praise = random.choice(PRAISES)
     await callback.message.edit_text(f"✅ Задача отмечена как выполненная!\n\n{praise}")
     await callback.message.answer(
@@ -583,6 +775,12 @@ async def complete_task(callback: types.CallbackQuery, state: FSMContext):
     )
     await state.update_data(report_task_id=int(task_id))
     await state.set_state(TaskStates.waiting_for_report)
+    # Командная задача: сообщаем остальным участникам, что её уже закрыли
+    if row and row[1] == "active":
+        others = [uid for uid in get_task_recipients(int(task_id)) if uid != callback.from_user.id]
+        if others:
+            name = html.escape(callback.from_user.full_name)
+            await broadcast(others, f"✅ {name} выполнил(а) командную задачу: <b>{html.escape(row[0])}</b>")
 
 @dp.message(TaskStates.waiting_for_report)
 async def save_report(message: types.Message, state: FSMContext):
@@ -597,16 +795,68 @@ async def save_report(message: types.Message, state: FSMContext):
     await message.answer("Отчет сохранен ✅", reply_markup=main_keyboard())
     await state.clear()
 
+# --- Участники и рассылка ---
+def get_task_recipients(task_id: int, owner_id: int = None):
+    """Владелец задачи первым, затем остальные участники."""
+    if owner_id is None:
+        cursor.execute('SELECT user_id FROM tasks WHERE id = ?', (task_id,))
+        row = cursor.fetchone()
+        if not row:
+            return []
+        owner_id = row[0]
+    cursor.execute('SELECT user_id FROM task_members WHERE task_id = ?', (task_id,))
+    return [owner_id] + [uid for (uid,) in cursor.fetchall() if uid != owner_id]
+
+async def wait_send_slot():
+    """Не даёт всем рассылкам вместе превысить BROADCAST_RATE_LIMIT сообщений в секунду."""
+    async with send_lock:
+        now = time.monotonic()
+        while send_times and now - send_times[0] >= 1:
+            send_times.popleft()
+        if len(send_times) >= BROADCAST_RATE_LIMIT:
+            await asyncio.sleep(1 - (now - send_times.popleft()))
+        send_times.append(time.monotonic())
+
+async def safe_send(user_id: int, text: str, reply_markup=None):
+    for attempt in range(2):
+        await wait_send_slot()
+        try:
+            await bot.send_message(user_id, text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+            return True
+        except TelegramRetryAfter as e:
+            # Flood control: ждём, сколько просит Telegram, и пробуем ещё раз
+            logger.warning(f"Flood control для пользователя {user_id}, ждём {e.retry_after} с")
+            if attempt == 0:
+                await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+            return False
+    return False
+
+async def broadcast(user_ids, text: str, reply_markup=None):
+    """Рассылает сообщение пачками по BROADCAST_BATCH_SIZE; темп задаёт wait_send_slot."""
+    user_ids = list(user_ids)
+    delivered = []
+    for start in range(0, len(user_ids), BROADCAST_BATCH_SIZE):
+        batch = user_ids[start:start + BROADCAST_BATCH_SIZE]
+        results = await asyncio.gather(*(safe_send(uid, text, reply_markup) for uid in batch))
+        delivered.extend(uid for uid, ok in zip(batch, results) if ok)
+    return delivered
+
 # --- Отправка напоминаний с юмором и строгим контролем ---
+# Одно задание планировщика на слот: участники командной задачи получают
+# напоминание из того же задания, а не из отдельной задачи на каждого.
 async def send_reminder(user_id: int, task_id: int):
     cursor.execute('SELECT task_text, created_at, status FROM tasks WHERE id = ?', (task_id,))
     row = cursor.fetchone()
     if not row:
         return
     task_text, created_at, status = row
+    if status != "active":
+        return
     created_dt = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S.%f") if '.' in created_at else datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
     days_passed = (datetime.now() - created_dt).days
-    if status == "active" and days_passed >= 3:
+    if days_passed >= 3:
         phrase = f"⚠️ Ты уже {days_passed} дня(ей) игнорируешь задачу: <b>{task_text}</b>!\n" \
                  "Начальник недоволен. Пора выполнить и отметить задачу!"
     else:
@@ -614,12 +864,11 @@ async def send_reminder(user_id: int, task_id: int):
         phrase = REMINDER_PHRASES[idx].format(task_text=task_text)
         if random.random() < 0.4:
             phrase += "\n\n" + random.choice(JOKES)
-    await bot.send_message(
-        user_id,
-        phrase,
-        parse_mode=ParseMode.HTML,
-        reply_markup=complete_keyboard(task_id)
-    )
+    recipients = get_task_recipients(task_id, user_id)
+    if len(recipients) > 1:
+        phrase = "👥 Командная задача\n" + phrase
+    delivered = await broadcast(recipients, phrase, reply_markup=complete_keyboard(task_id))
+    log_reminders(delivered, task_id)
 
 # --- Основная функция ---
 async def main():
@@ -628,7 +877,6 @@ async def main():
     await dp.start_polling(bot, skip_updates=True)
 
 if __name__ == "__main__":
-    import asyncio
     try:
         asyncio.run(main())
     finally: